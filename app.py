@@ -1,53 +1,264 @@
+# Patch sockets before anything (groq/httpx) imports them so Groq calls yield under gevent.
+from gevent import monkey
+monkey.patch_all()
+
 import os
+import atexit
 import logging
-from flask import Flask, request, jsonify
+import threading
+from logging.handlers import QueueHandler, QueueListener
+import httpx
+import orjson
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
-from groq import Groq
-from datetime import datetime
+from groq import APIError, DefaultHttpxClient, Groq
+from datetime import datetime, timezone
+from types import MappingProxyType
 from uuid import uuid4
-from pydantic import BaseModel, Field
-from typing import Literal, Optional, List, Dict, Any
+from pydantic import BaseModel, StrictFloat, StrictInt, StrictStr, ValidationError
+from typing import Optional, Dict, Any, Union
+from singleflight import SingleFlight
+from cache import RedisStoryCache, StoryCache, make_cache_key
+from semantic_cache import SemanticCache, semantic_cache_available
+from utils import ORJSONProvider
 
 load_dotenv()
 
 # ---- Flask Setup ----
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+app.json = ORJSONProvider(app)
+
+# ---- Logging ----
+# Request greenlets only enqueue records; a listener on a native OS thread does the
+# file/console I/O. After monkey.patch_all() threading.Thread is a greenlet on the
+# hub's own thread, so the listener thread, its queue and its handler locks are
+# built from the unpatched primitives.
+start_native_thread, allocate_native_lock, NativeRLock = monkey.get_original(
+    "_thread", ["start_new_thread", "allocate_lock", "RLock"]
+)
+NativeQueue = monkey.get_original("queue", "SimpleQueue")
+
+class NativeQueueListener(QueueListener):
+    def start(self):
+        self._stopped = allocate_native_lock()
+        self._stopped.acquire()
+        start_native_thread(self._run, ())
+
+    def _run(self):
+        try:
+            self._monitor()
+        finally:
+            self._stopped.release()
+
+    def stop(self):
+        self.enqueue_sentinel()
+        self._stopped.acquire()
+
+log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+log_handlers = [logging.FileHandler(os.getenv("LOG_FILE", "app.log")), logging.StreamHandler()]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+    handler.lock = NativeRLock()
+log_queue_handler = QueueHandler(NativeQueue())
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(log_queue_handler)
+log_listener = None
+
+def start_log_listener():
+    """Start the listener thread on a fresh queue (threads don't survive fork)."""
+    global log_listener
+    log_queue_handler.queue = NativeQueue()
+    log_listener = NativeQueueListener(log_queue_handler.queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+
+def stop_log_listener():
+    if log_listener is not None:
+        log_listener.stop()
+
+start_log_listener()
+# With gunicorn --preload the app is imported once in the master and then forked.
+os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(stop_log_listener)
+
+@app.before_request
+def log_request():
+    # Never parse the body here: story_agent does the one JSON parse per request.
+    logging.info("%s %s (%s bytes)", request.method, request.path, request.headers.get("Content-Length", 0))
+    if root_logger.isEnabledFor(logging.DEBUG):
+        logging.debug("body preview: %r", request.get_data(cache=True)[:512])
 
 # ---- Models (ported from blog) ----
-class MessagePart(BaseModel):
-    kind: Literal["text", "data", "file"]
-    text: Optional[str] = None
-    data: Optional[Dict[str, Any]] = None
-    file_url: Optional[str] = None
-
-class A2AMessage(BaseModel):
-    kind: Literal["message"] = "message"
-    role: Literal["user", "agent", "system"]
-    parts: List[MessagePart]
-    messageId: str = Field(default_factory=lambda: str(uuid4()))
-    taskId: Optional[str] = None
-
-class TaskStatus(BaseModel):
-    state: Literal["working", "completed", "input-required", "failed"]
-    timestamp: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
-    message: Optional[A2AMessage] = None
-
-class Artifact(BaseModel):
-    artifactId: str = Field(default_factory=lambda: str(uuid4()))
-    name: str
-    parts: List[MessagePart]
-
-class TaskResult(BaseModel):
-    id: str
-    contextId: str
-    status: TaskStatus
-    artifacts: List[Artifact] = []
-    history: List[A2AMessage] = []
-    kind: Literal["task"] = "task"
+class JsonRpcRequest(BaseModel):
+    jsonrpc: Optional[str] = None
+    # Strict so the id is echoed back exactly (no bool -> int or float rejection).
+    id: Union[StrictStr, StrictInt, StrictFloat, None]
+    method: Optional[str] = None
+    params: Dict[str, Any] = {}
+
+# ---- JSON-RPC Methods ----
+# Shared read-only defaults so missing keys don't allocate per request.
+EMPTY = ()
+EMPTY_MAPPING = MappingProxyType({})
+
+def parts_of(message):
+    """The message's parts list, or EMPTY if the message or its parts are malformed."""
+    if not isinstance(message, dict):
+        return EMPTY
+    parts = message.get("parts", EMPTY)
+    return parts if isinstance(parts, list) else EMPTY
+
+def execute_message(params):
+    messages = params.get("messages")
+    return messages[-1] if isinstance(messages, list) and messages else EMPTY_MAPPING
+
+# Method -> function pulling the message parts out of `params`.
+PART_EXTRACTORS = {
+    "message/send": lambda params: parts_of(params.get("message")),
+    "execute": lambda params: parts_of(execute_message(params)),
+}
+
+# ---- Admission Control ----
+# Shed load with a 429 instead of letting requests pile up behind a slow Groq backend.
+# Only Groq calls take a slot; cache hits are always served.
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", 64))
+inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
+
+class ServerOverloaded(Exception):
+    """Raised when MAX_INFLIGHT Groq calls are already running in this worker."""
 
 # ---- Groq Client ----
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+GROQ_MODEL = "llama-3.1-8b-instant"
+# ~250 words is ~330 tokens; cap generation so a verbose completion can't run long.
+GROQ_COMPLETION_PARAMS = {
+    "max_tokens": 350,
+    "temperature": 0.8,
+    "top_p": 0.9,
+    "stop": ["\n\n\n"],
+}
+# One pooled HTTP/2 client per process so concurrent calls reuse warm TLS connections.
+groq_http_client = DefaultHttpxClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", 100)),
+        max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", 200)),
+    ),
+    timeout=httpx.Timeout(30.0, connect=5.0),
+)
+groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=groq_http_client)
+
+SYSTEM_PROMPT = "You are a creative storyteller. Write a short story under 250 words based on the user's phrase."
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+def build_messages(text_input):
+    """
+    Chat messages for a phrase. The instructions are a static system message
+    and the phrase is the only dynamic content, placed last, so the provider
+    can reuse its cached prompt prefix across calls.
+    """
+    return [SYSTEM_MESSAGE, {"role": "user", "content": text_input}]
+
+def complete(text_input):
+    """Run a single Groq chat completion and return the stripped text."""
+    if not inflight.acquire(blocking=False):
+        raise ServerOverloaded()
+    try:
+        response = groq_client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=build_messages(text_input),
+            **GROQ_COMPLETION_PARAMS,
+        )
+    finally:
+        inflight.release()
+    return response.choices[0].message.content.strip()
+
+# Concurrent requests for the same phrase share one Groq call.
+story_flight = SingleFlight(complete)
+
+# ---- Story Cache ----
+story_cache = StoryCache(maxsize=int(os.getenv("STORY_CACHE_SIZE", 1024)))
+
+# Optional second tier shared across gunicorn workers.
+shared_cache = None
+if os.getenv("REDIS_URL"):
+    shared_cache = RedisStoryCache(
+        os.getenv("REDIS_URL"),
+        ttl=int(os.getenv("STORY_CACHE_TTL", 86400)),
+    )
+
+# Stories are sampled at temperature > 0, but the caches deliberately serve one
+# sampled story per phrase: variety between repeat requests is traded for latency,
+# so the semantic cache is not bypassed for non-zero temperature.
+semantic_cache = None
+if os.getenv("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes"):
+    if semantic_cache_available():
+        semantic_cache = SemanticCache(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+            maxsize=int(os.getenv("STORY_CACHE_SIZE", 1024)),
+        )
+    else:
+        logging.warning("SEMANTIC_CACHE is set but sentence-transformers is not installed")
+
+def lookup_story(text_input):
+    """
+    Return (cache key, cached story or None, phrase embedding or None).
+    The embedding is only computed when the semantic cache is consulted, and
+    is handed back to store_story so a miss encodes the phrase once.
+    """
+    # Include the sampling/length params so changing them invalidates cached (and Redis) stories.
+    key = make_cache_key(GROQ_MODEL, {"messages": build_messages(text_input), **GROQ_COMPLETION_PARAMS})
+    embedding = None
+    story = story_cache.get(key)
+    if story is None and shared_cache is not None:
+        story = shared_cache.get(key)
+        if story is not None:
+            story_cache.set(key, story)
+    if story is None and semantic_cache is not None:
+        story, embedding = semantic_cache.get(text_input)
+        if story is not None:
+            story_cache.set(key, story)
+    return key, story, embedding
+
+def store_story(key, text_input, story, embedding=None):
+    # An empty completion is a failed generation, not a story; let the next request retry.
+    if not story:
+        return
+    story_cache.set(key, story)
+    if shared_cache is not None:
+        shared_cache.set(key, story)
+    if semantic_cache is not None:
+        semantic_cache.set(text_input, story, embedding)
+
+def generate_story(text_input):
+    """Return a story for the phrase, calling Groq only on a cache miss."""
+    key, story, embedding = lookup_story(text_input)
+    if story is None:
+        story = story_flight.call(text_input)
+        store_story(key, text_input, story, embedding)
+    return story
+
+def open_story_stream(text_input):
+    """
+    Start a streaming Groq completion. Called before the SSE response is
+    returned, so failures to start still surface as a normal JSON error.
+    """
+    return groq_client.chat.completions.create(
+        model=GROQ_MODEL,
+        messages=build_messages(text_input),
+        stream=True,
+        **GROQ_COMPLETION_PARAMS,
+    )
+
+def iter_story_deltas(stream):
+    finish_reason = None
+    for chunk in stream:
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        if choice.delta.content:
+            yield choice.delta.content
+    # A stream that stops without a finish_reason was cut off; don't treat it as a story.
+    if finish_reason is None:
+        raise RuntimeError("Groq stream ended without a finish_reason")
 
 # ---- Metadata ----
 AGENT_METADATA = {
@@ -62,76 +273,178 @@ AGENT_METADATA = {
     "repo": "https://github.com/ifeadewumi/story-agent-flask",
     "logo_url": "https://i.ibb.co/Jc0Hkqs/story-logo.png"
 }
+# Static payload, so encode it once at import time.
+AGENT_METADATA_JSON = orjson.dumps(AGENT_METADATA)
 
 @app.route("/", methods=["GET"])
 def metadata():
-    return jsonify(AGENT_METADATA)
+    response = Response(AGENT_METADATA_JSON, mimetype="application/json")
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
 
 @app.route("/a2a/story-agent", methods=["POST"])
 def story_agent():
-    body = request.get_json(force=True)
+    # Parse and validate in one pass (pydantic-core/jiter) straight from the raw body.
+    try:
+        body = JsonRpcRequest.model_validate_json(request.get_data(cache=True))
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors()):
+            error = {"code": -32700, "message": "Parse error"}
+        else:
+            error = {"code": -32600, "message": "Invalid Request"}
+        return jsonify({"jsonrpc": "2.0", "id": None, "error": error}), 400
 
-    if body.get("jsonrpc") != "2.0" or "id" not in body:
+    if body.jsonrpc != "2.0":
         return jsonify({
-            "jsonrpc": "2.0", "id": body.get("id"),
+            "jsonrpc": "2.0", "id": body.id,
             "error": {"code": -32600, "message": "Invalid Request"}
         }), 400
 
-    rpc_id = body["id"]
-    method = body.get("method")
-    params = body.get("params", {})
+    rpc_id = body.id
+    method = body.method
+    params = body.params
 
     # Extract text input
-    parts = []
-    if method == "message/send":
-        message = params.get("message", {})
-        parts = message.get("parts", [])
-    elif method == "execute":
-        messages = params.get("messages", [])
-        parts = messages[-1].get("parts", []) if messages else []
-    else:
+    extract_parts = PART_EXTRACTORS.get(method)
+    if extract_parts is None:
         return jsonify({
             "jsonrpc": "2.0", "id": rpc_id,
             "error": {"code": -32601, "message": "Unsupported method"}
         }), 400
 
-    text_input = next((p.get("text") for p in parts if p.get("kind") == "text"), "")
+    for part in extract_parts(params):
+        if (
+            isinstance(part, dict) and part.get("kind") == "text"
+            and isinstance(text := part.get("text"), str) and text
+        ):
+            text_input = text.strip()
+            break
+    else:
+        text_input = ""
     if not text_input:
         return jsonify({
             "jsonrpc": "2.0", "id": rpc_id,
             "error": {"code": -32602, "message": "Missing text input"}
         }), 400
 
-    # --- Generate Story ---
-    prompt = f"Write a short story (under 250 words) based on: '{text_input}'"
-    response = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[{"role": "user", "content": prompt}],
-    )
-    story = response.choices[0].message.content.strip()
+    # --- Stream Story (SSE) ---
+    if wants_stream():
+        key, story, embedding = lookup_story(text_input)
+        stream = None
+        if story is not None:
+            events = sse_story_events(rpc_id, (story,))
+        else:
+            if not inflight.acquire(blocking=False):
+                return overloaded_response(rpc_id)
+            try:
+                stream = open_story_stream(text_input)
+            except Exception:
+                inflight.release()
+                logging.exception("Groq stream failed to start")
+                return jsonify(generation_error(rpc_id)), 502
+            events = sse_story_events(
+                rpc_id, iter_story_deltas(stream),
+                on_complete=lambda story: store_story(key, text_input, story, embedding),
+            )
+        response = Response(events, mimetype="text/event-stream")
+        if stream is not None:
+            response.call_on_close(inflight.release)
+            response.call_on_close(stream.close)
+        return response
 
-    # --- Build Proper A2A Result ---
-    response_msg = A2AMessage(
-        role="agent",
-        parts=[MessagePart(kind="text", text=story)]
-    )
-    result = TaskResult(
-        id=str(uuid4()),
-        contextId=str(uuid4()),
-        status=TaskStatus(state="completed", message=response_msg),
-        artifacts=[],
-        history=[],
-    )
+    # --- Generate Story ---
+    try:
+        story = generate_story(text_input)
+    except ServerOverloaded:
+        return overloaded_response(rpc_id)
+    except APIError:
+        logging.exception("Groq completion failed")
+        return jsonify(generation_error(rpc_id)), 502
 
     return jsonify({
         "jsonrpc": "2.0",
         "id": rpc_id,
-        "result": result.model_dump()
+        "result": build_task_result(story)
     }), 200
 
+def build_task_result(story):
+    """A2A task result for a completed story."""
+    # Plain dicts: the data is built server-side, so model validation is pure overhead.
+    # One random ID per response; the other IDs are derived from it.
+    task_id = str(uuid4())
+    return {
+        "id": task_id,
+        "contextId": f"{task_id}-ctx",
+        "status": {
+            "state": "completed",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "message": {
+                "kind": "message",
+                "role": "agent",
+                "parts": [{"kind": "text", "text": story, "data": None, "file_url": None}],
+                "messageId": f"{task_id}-msg",
+                "taskId": None,
+            },
+        },
+        "artifacts": [],
+        "history": [],
+        "kind": "task",
+    }
+
+def wants_stream():
+    """Stream when asked via ?stream=1 or an Accept header preferring text/event-stream."""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", "text/event-stream"])
+    return best == "text/event-stream"
+
+def sse_event(payload, event=None):
+    data = b"data: " + orjson.dumps(payload) + b"\n\n"
+    return b"event: " + event.encode() + b"\n" + data if event else data
+
+def overloaded_response(rpc_id):
+    response = jsonify({
+        "jsonrpc": "2.0", "id": rpc_id,
+        "error": {"code": -32000, "message": "Server overloaded, retry later"}
+    })
+    response.headers["Retry-After"] = "1"
+    return response, 429
+
+def generation_error(rpc_id):
+    return {
+        "jsonrpc": "2.0", "id": rpc_id,
+        "error": {"code": -32603, "message": "Story generation failed"}
+    }
+
+def sse_story_events(rpc_id, deltas, on_complete=None):
+    """
+    SSE stream: one `data: {"delta": ...}` event per chunk, then a `result`
+    event carrying the same JSON-RPC envelope the non-streaming call returns.
+    If generation fails part-way, an `error` event with a JSON-RPC error
+    envelope is sent instead of `result`.
+    """
+    chunks = []
+    try:
+        for delta in deltas:
+            chunks.append(delta)
+            yield sse_event({"delta": delta})
+    except Exception:
+        logging.exception("Groq stream failed")
+        yield sse_event(generation_error(rpc_id), event="error")
+        return
+    story = "".join(chunks).strip()
+    if on_complete is not None:
+        on_complete(story)
+    yield sse_event({"jsonrpc": "2.0", "id": rpc_id, "result": build_task_result(story)}, event="result")
+
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "healthy", "agent": "story-agent"})
+    cache_stats = {"exact": story_cache.stats()}
+    if shared_cache is not None:
+        cache_stats["redis"] = shared_cache.stats()
+    if semantic_cache is not None:
+        cache_stats["semantic"] = semantic_cache.stats()
+    return jsonify({"status": "healthy", "agent": "story-agent", "cache": cache_stats})
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
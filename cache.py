@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import redis
+
+
+def make_cache_key(model, prompt):
+    """Stable SHA-256 key for a (model, prompt) pair; prompt may be any JSON-serialisable request payload."""
+    raw = json.dumps({"model": model, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class StoryCache:
+    """Bounded, thread-safe LRU cache of generated stories."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            story = self._data.get(key)
+            if story is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return story
+
+    def set(self, key, story):
+        with self._lock:
+            self._data[key] = story
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class RedisStoryCache:
+    """
+    Story cache shared by every worker through Redis, so a phrase generated by
+    one worker is a hit for the others and survives restarts. Redis failures
+    are logged and treated as misses so the agent keeps serving from Groq.
+    """
+
+    def __init__(self, url, ttl=86400, prefix="story:"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # Timeouts must be set on the pool; redis.Redis ignores them when given a pool.
+        self._client = redis.Redis(
+            connection_pool=redis.BlockingConnectionPool.from_url(
+                url,
+                max_connections=50,
+                timeout=1,
+                socket_timeout=0.5,
+                socket_connect_timeout=0.5,
+            )
+        )
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        try:
+            story = self._client.get(self.prefix + key)
+        except redis.RedisError as e:
+            self._count("errors")
+            logging.warning("Redis cache get failed: %s", e)
+            return None
+        if story is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return story.decode()
+
+    def set(self, key, story):
+        try:
+            self._client.setex(self.prefix + key, self.ttl, story)
+        except redis.RedisError as e:
+            self._count("errors")
+            logging.warning("Redis cache set failed: %s", e)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
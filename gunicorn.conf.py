@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+
+# The workload is I/O-bound (waiting on Groq), so gevent workers let each
+# process keep many requests in flight while greenlets yield on socket waits.
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", 1000))
+timeout = 60
+
+# Import the app (and build the Groq client) once in the master before forking.
+# app.py monkey-patches sockets on import, ahead of creating the client, and
+# restarts its log listener in each forked worker.
+preload_app = True
@@ -0,0 +1,90 @@
+import threading
+
+from gevent import get_hub
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional dependency
+    np = None
+    SentenceTransformer = None
+
+
+def semantic_cache_available():
+    return SentenceTransformer is not None
+
+
+class SemanticCache:
+    """
+    Cache stories by embedding similarity so paraphrased phrases
+    ("cat on a mat" / "a cat sitting on a mat") reuse a prior story.
+    Embeddings are stored L2-normalised, so a lookup is one matrix-vector product.
+    """
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", threshold=0.92, maxsize=1024):
+        if not semantic_cache_available():
+            raise RuntimeError("sentence-transformers is not installed")
+        self.model_name = model_name
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Loaded on first use so torch is never initialised in a gunicorn master
+        # that will fork (preload_app), which can deadlock the workers.
+        self._model = None
+        self._embeddings = None
+        self._stories = [None] * maxsize
+        self._count = 0
+        self._next = 0
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _in_thread(self, fn, *args):
+        # Model loading and encoding are CPU-bound; run them on the hub's native
+        # threadpool so other greenlets in the worker keep running meanwhile.
+        return get_hub().threadpool.apply(fn, args)
+
+    def _ensure_model(self):
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is None:
+                model = self._in_thread(SentenceTransformer, self.model_name)
+                dim = model.get_sentence_embedding_dimension()
+                self._embeddings = np.zeros((self.maxsize, dim), dtype=np.float32)
+                self._model = model
+
+    def _encode(self, text):
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def embed(self, text):
+        self._ensure_model()
+        return self._in_thread(self._encode, text)
+
+    def get(self, text):
+        """
+        Return (story or None, query embedding). Pass the embedding back to
+        `set` so a miss doesn't encode the same phrase twice.
+        """
+        q = self.embed(text)
+        with self._lock:
+            if self._count:
+                sims = self._embeddings[:self._count] @ q
+                i = int(np.argmax(sims))
+                if sims[i] > self.threshold:
+                    self.hits += 1
+                    return self._stories[i], q
+            self.misses += 1
+            return None, q
+
+    def set(self, text, story, embedding=None):
+        q = self.embed(text) if embedding is None else embedding
+        with self._lock:
+            self._embeddings[self._next] = q
+            self._stories[self._next] = story
+            self._next = (self._next + 1) % self.maxsize
+            self._count = min(self._count + 1, self.maxsize)
+
+    def stats(self):
+        with self._lock:
+            return {"size": self._count, "hits": self.hits, "misses": self.misses}
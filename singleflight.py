@@ -0,0 +1,40 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same prompt into one call.
+
+    Groq has no multi-prompt completion endpoint, so there is nothing to gain
+    from holding prompts back to batch them; distinct prompts run straight away
+    on the caller's own thread (a greenlet under gevent). The first caller for a
+    prompt runs `fn`, and callers arriving while it is in flight wait for and
+    share its result or exception.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def call(self, prompt):
+        with self._lock:
+            future = self._inflight.get(prompt)
+            leader = future is None
+            if leader:
+                future = self._inflight[prompt] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = self.fn(prompt)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[prompt]
@@ -1,3 +1,38 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+
+class ORJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson, used by jsonify and request.get_json.
+    Falls back to the stdlib provider for values orjson can't encode, such as
+    integers wider than 64 bits.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._fallback = DefaultJSONProvider(app)
+
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+        except orjson.JSONEncodeError:
+            return self._fallback.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            data = orjson.dumps(obj, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return self._fallback.response(obj)
+        return self._app.response_class(data, mimetype="application/json")
+
+
 def is_valid_telex_payload(body):
     """
     Validate Telex A2A message payload.